@@ -1,104 +1,551 @@
 import os
+import re
+import json
+import fractions
+import queue
+import hashlib
+import secrets
+import signal
+import shutil
 import time
 import tempfile
-from flask import Flask, request, render_template, send_from_directory, redirect, url_for, flash, session
+import threading
+import subprocess
+from flask import Flask, Response, abort, jsonify, request, render_template, send_from_directory, redirect, url_for, flash, session
+from flask_session import Session
+from redis import Redis
 from werkzeug.utils import secure_filename
 
 UPLOAD_FOLDER = 'uploads'
-OUTPUT_FOLDER = 'gifs'
-ALLOWED_EXTENSIONS = {'webm', 'mp4', 'avi', 'mov', 'mkv', 'flv', 'wmv', 'mpeg'}
+STATIC_GIF_DIR = os.path.join('static', 'gifs')
+OUTPUT_FOLDER = STATIC_GIF_DIR  # GIFs are written once and served for both preview and download
+ALLOWED_EXTENSIONS = frozenset(('webm', 'mp4', 'avi', 'mov', 'mkv', 'flv', 'wmv', 'mpeg'))
 MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB limit
+MAX_VIDEO_DURATION = 600  # Seconds; longer inputs are rejected before any decoding
+# Video codecs FFmpeg decodes reliably for the containers we accept
+ALLOWED_CODECS = frozenset((
+    'h264', 'hevc', 'vp8', 'vp9', 'av1', 'mpeg4', 'mpeg1video', 'mpeg2video',
+    'msmpeg4v2', 'msmpeg4v3', 'wmv1', 'wmv2', 'wmv3', 'vc1', 'flv1', 'vp6', 'vp6f', 'vp6a', 'h263',
+    'mjpeg', 'prores', 'theora'
+))
+# Same bounds as the upload form's fps/width inputs, enforced server-side for the form and /batch
+MIN_FPS, MAX_FPS = 1, 30
+MIN_WIDTH, MAX_WIDTH = 50, 1920
+MAX_BATCH_CLIPS = 10  # Upper bound on GIFs produced by a single /batch request
+CLEANUP_INTERVAL = 600  # Seconds between background sweeps of old files
+CLEANUP_MAX_AGE_HOURS = 1
+# mkstemp creates 0600 files; cached GIFs get normal umask permissions so nginx/Apache can read them
+_umask = os.umask(0)
+os.umask(_umask)
+GIF_FILE_MODE = 0o666 & ~_umask
+NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')  # Plain non-negative numbers such as 10 or 10.5
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # For flashing messages
+# Production must set SECRET_KEY so every worker and restart signs sessions with the same key;
+# the random fallback only suits a single dev-server process
+app.secret_key = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+# Let the front-end server send GIF downloads itself: set to the internal nginx location
+# (e.g. /_protected_gifs) for X-Accel-Redirect, or set USE_X_SENDFILE=1 for Apache mod_xsendfile
+app.config['ACCEL_REDIRECT_PREFIX'] = os.environ.get('ACCEL_REDIRECT_PREFIX', '').rstrip('/')
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+
+# Keep session data in Redis so the cookie only carries a session id, not file paths
+if os.environ.get('REDIS_URL'):
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = Redis.from_url(os.environ['REDIS_URL'])
+    Session(app)
+
+# Paths waiting to be unlinked by the background deleter thread
+delete_queue = queue.SimpleQueue()
 
 # Create directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-os.makedirs(os.path.join('static', 'gifs'), exist_ok=True)
+
+
+def detect_cuda_hwaccel():
+    """Return True if FFmpeg supports CUDA decoding and a CUDA device can actually be opened"""
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-hwaccels'], capture_output=True, text=True)
+        if result.returncode != 0 or 'cuda' not in result.stdout.split():
+            return False
+        # -hwaccels only describes the build; initialising the device proves a usable GPU and driver
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-init_hw_device', 'cuda',
+             '-f', 'lavfi', '-i', 'nullsrc=s=16x16', '-frames:v', '1', '-f', 'null', '-'],
+            capture_output=True, timeout=30
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return result.returncode == 0
+
+
+def detect_cuda_scaler():
+    """Return the GPU scale filter this FFmpeg build provides (scale_npp, scale_cuda) or None"""
+    try:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-filters'], capture_output=True, text=True)
+    except OSError:
+        return None
+    filters = result.stdout.split()
+    # scale_npp needs a nonfree --enable-libnpp build, so most CUDA builds only have scale_cuda
+    for name in ('scale_npp', 'scale_cuda'):
+        if name in filters:
+            return name
+    return None
+
+
+# Probe once at startup so every conversion can pick the NVDEC path without re-checking
+CUDA_AVAILABLE = detect_cuda_hwaccel()
+CUDA_SCALER = detect_cuda_scaler() if CUDA_AVAILABLE else None
+
+# Run conversions at low CPU and idle I/O priority so they can't starve request handling
+LOW_PRIORITY_CMD = []
+if shutil.which('ionice'):
+    LOW_PRIORITY_CMD = ['ionice', '-c', '3'] + LOW_PRIORITY_CMD
+if shutil.which('nice'):
+    LOW_PRIORITY_CMD = ['nice', '-n', '10'] + LOW_PRIORITY_CMD
+
+# Quiet, non-interactive FFmpeg: only errors reach stderr, so there is no per-frame log to read back
+FFMPEG_CMD = LOW_PRIORITY_CMD + ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-nostats']
+
+
+
+def detect_gifski():
+    """Return True if gifski is installed and can encode YUV4MPEG frames read from stdin"""
+    if shutil.which('gifski') is None:
+        return False
+    # A single 2x2 4:4:4 frame is enough to tell whether this build accepts Y4M on stdin
+    frame = b'YUV4MPEG2 W2 H2 F10:1 Ip A1:1 C444\nFRAME\n' + bytes(2 * 2 * 3)
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            result = subprocess.run(
+                ['gifski', '--quiet', '-o', os.path.join(directory, 'probe.gif'), '-'],
+                input=frame, capture_output=True, timeout=10
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+    return result.returncode == 0
+
+
+# gifski's multi-threaded perceptual quantizer gives smaller GIFs than palettegen when usable
+GIFSKI_AVAILABLE = detect_gifski()
+GIFSKI_CMD = LOW_PRIORITY_CMD + ['gifski', '--quiet']
 
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, extension = filename.rpartition('.')
+    return bool(dot) and extension.lower() in ALLOWED_EXTENSIONS
+
+
+def parse_number(value):
+    """Return a form value as a float, None if it is blank, or raise ValueError if it isn't a number"""
+    value = value.strip()
+    if not value:
+        return None
+    if not NUMBER_RE.fullmatch(value):
+        raise ValueError(value)
+    return float(value)
+
+
+def gif_cache_name(digest, fps, width, start_time, end_time):
+    """Name a GIF after the source content hash and its conversion parameters"""
+    return (
+        f"{digest[:16]}_{fps}_{width or 'orig'}_"
+        f"{'start' if start_time is None else start_time}_{'end' if end_time is None else end_time}.gif"
+    )
+
+
+def parse_conversion_params(form):
+    """Validate the conversion form fields and return (fps, width, start_time, end_time)"""
+    try:
+        fps = parse_number(form.get('fps', ''))
+        width = parse_number(form.get('width', ''))
+        if any(value is not None and (value < 1 or not value.is_integer()) for value in (fps, width)):
+            raise ValueError
+    except ValueError:
+        raise ValueError('FPS and width must be positive whole numbers')
+
+    try:
+        start_time = parse_number(form.get('start_time', ''))
+        end_time = parse_number(form.get('end_time', ''))
+    except ValueError:
+        raise ValueError('Invalid time format. Please use seconds (e.g., 10.5)')
+    if start_time is not None and end_time is not None and end_time <= start_time:
+        raise ValueError('End time must be after start time')
+
+    fps = int(fps) if fps is not None else 10
+    width = int(width) if width is not None else None
+    if not MIN_FPS <= fps <= MAX_FPS:
+        raise ValueError(f'FPS must be between {MIN_FPS} and {MAX_FPS}')
+    if width is not None and not MIN_WIDTH <= width <= MAX_WIDTH:
+        raise ValueError(f'Width must be between {MIN_WIDTH} and {MAX_WIDTH} pixels')
+    return fps, width, start_time, end_time
 
 
 def clean_old_files(directory, max_age_hours=24):
     """Remove files older than max_age_hours from the specified directory"""
-    current_time = time.time()
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
-        # If file is older than max_age_hours, delete it
-        if os.path.isfile(file_path) and (current_time - os.path.getmtime(file_path)) > max_age_hours * 3600:
+    cutoff = time.time() - max_age_hours * 3600
+    # scandir entries cache their stat info, saving a syscall per file compared to listdir + getmtime
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
             try:
-                os.remove(file_path)
-            except Exception as e:
-                print(f"Error removing {file_path}: {e}")
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                # Already removed by a download cleanup or another worker's janitor
+                pass
+            except OSError as e:
+                print(f"Error removing {entry.path}: {e}")
+
+
+def cleanup_loop():
+    """Periodically remove old uploads and GIFs; runs forever in a daemon thread"""
+    while True:
+        time.sleep(CLEANUP_INTERVAL)
+        for directory in (app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']):
+            try:
+                clean_old_files(directory, max_age_hours=CLEANUP_MAX_AGE_HOURS)
+            except OSError as e:
+                print(f"Error cleaning {directory}: {e}")
 
 
 def delete_file_safely(file_path):
     """Delete a file if it exists and return success status"""
+    # Just try the unlink: checking existence first costs a syscall and races with the janitor
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            return True
+        os.unlink(file_path)
+        return True
+    except FileNotFoundError:
         return False
-    except Exception as e:
+    except OSError as e:
         print(f"Error deleting file {file_path}: {e}")
         return False
 
 
-def convert_video_to_gif(input_path, output_path, start_time=None, end_time=None, fps=10, width=None):
-    """Convert video to GIF using FFmpeg subprocess instead of loading whole video into memory"""
-    import subprocess
-    import shlex
-    
-    # Start building the FFmpeg command
-    cmd = ['ffmpeg', '-i', input_path]
-    
-    # Add start time if specified
-    if start_time is not None:
-        cmd.extend(['-ss', str(start_time)])
-    
-    # Add end time if specified (as duration from start)
-    if end_time is not None and start_time is not None:
-        duration = end_time - start_time
-        cmd.extend(['-t', str(duration)])
-    elif end_time is not None:
-        cmd.extend(['-to', str(end_time)])
-    
-    # Set framerate
-    cmd.extend(['-r', str(fps)])
-    
-    # Set width if specified (maintain aspect ratio)
-    if width is not None:
-        cmd.extend(['-vf', f'scale={width}:-1:flags=lanczos'])
-    
-    # Add output options for GIF
-    cmd.extend([
-        '-f', 'gif',
-        output_path
-    ])
-    
-    # Execute the command
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    
+def spooled_upload_path(stream):
+    """Return a path FFmpeg can open to read an upload stream's spooled temporary file, or None
+
+    Werkzeug has already written larger uploads to an anonymous temporary file while parsing the
+    request body; reading it through /proc/<pid>/fd avoids copying it again with file.save().
+    """
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError):
+        # Small uploads are kept in memory (BytesIO) and have no file descriptor
+        return None
+    path = f'/proc/{os.getpid()}/fd/{fd}'
+    return path if os.path.exists(path) else None
+
+
+def hash_stream(stream):
+    """Return the SHA-256 hex digest of a seekable binary stream and rewind it"""
+    digest = hashlib.file_digest(stream, 'sha256').hexdigest()
+    stream.seek(0)
+    return digest
+
+
+def delete_worker():
+    """Unlink queued paths off the request thread; runs forever in a daemon thread"""
+    while True:
+        delete_file_safely(delete_queue.get())
+
+
+def run_ffmpeg(args):
+    """Run FFmpeg with the given arguments and raise with its error output if it fails"""
+    result = subprocess.run(FFMPEG_CMD + args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
     if result.returncode != 0:
-        raise Exception(f"FFmpeg error: {result.stderr}")
-    
+        # Only decode the log when there is something to report
+        raise Exception(f"FFmpeg error: {result.stderr.decode(errors='replace')}")
+
+
+def run_palette_passes(input_args, filters, output_path):
+    """Run the palettegen/paletteuse passes for the given input arguments and filter chain"""
+    # The palette is written to a temporary PNG and removed once the GIF is encoded
+    palette = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+    palette.close()
+
+    try:
+        # Pass 1: build an optimized 256-colour palette for the clip
+        run_ffmpeg(input_args + [
+            '-vf', f'{filters},palettegen=stats_mode=diff',
+            '-y', palette.name
+        ])
+
+        # Pass 2: encode the GIF against the generated palette
+        run_ffmpeg(input_args + [
+            '-i', palette.name,
+            '-lavfi', f'{filters}[x];[x][1:v]paletteuse=dither=bayer:bayer_scale=5',
+            '-y', output_path
+        ])
+    finally:
+        delete_file_safely(palette.name)
+
+
+class EncoderError(Exception):
+    """Raised when gifski fails on frames FFmpeg decoded successfully"""
+
+
+def run_gifski(input_args, filters, fps, width, output_path):
+    """Decode and scale with FFmpeg, then quantize and encode the frames with gifski"""
+    # Frames travel as raw YUV4MPEG, which gifski reads from stdin without any PNG round-trip
+    decoder_cmd = FFMPEG_CMD + input_args + ['-vf', filters, '-pix_fmt', 'yuv444p', '-f', 'yuv4mpegpipe', '-']
+    # gifski shrinks to roughly 800x600 unless told otherwise, so always pass the intended width
+    encoder_cmd = GIFSKI_CMD + ['--fps', str(fps), '--width', str(width), '-o', output_path, '-']
+
+    # Each process logs to its own temporary file so neither can block on a full stderr pipe
+    with tempfile.TemporaryFile() as decoder_errors, tempfile.TemporaryFile() as encoder_errors:
+        decoder = subprocess.Popen(decoder_cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=decoder_errors)
+        encoder = subprocess.Popen(encoder_cmd, stdin=decoder.stdout, stdout=subprocess.DEVNULL, stderr=encoder_errors)
+        # gifski owns the read end now; closing ours lets FFmpeg see a broken pipe if gifski dies
+        decoder.stdout.close()
+
+        decoder.wait()
+        encoder.wait()
+
+        if decoder.returncode == 0 and encoder.returncode == 0:
+            return
+        decoder_errors.seek(0)
+        encoder_errors.seek(0)
+        decoder_message = decoder_errors.read().decode(errors='replace')
+        encoder_message = encoder_errors.read().decode(errors='replace')
+
+    # When gifski exits early FFmpeg dies of SIGPIPE or reports a broken pipe, which is still an
+    # encoder failure; any other decoder failure is a bad input that another encoder wouldn't fix
+    broken_pipe = decoder.returncode == -signal.SIGPIPE or 'Broken pipe' in decoder_message
+    if encoder.returncode != 0 and (decoder.returncode == 0 or broken_pipe):
+        raise EncoderError(f"gifski error: {encoder_message}")
+    raise Exception(f"FFmpeg error: {decoder_message}")
+
+
+def build_filter_chain(fps, width, use_cuda=False):
+    """Return the hwaccel input arguments and frame rate/scaling filter chain for a conversion"""
+    filters = f'fps={fps}'
+
+    if use_cuda:
+        # Decode on NVDEC and resize on the GPU when the build has a CUDA scaler, then download
+        # frames for the CPU-only palette filters; without one, scale on the CPU after hwdownload
+        hw_args = ['-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda']
+        if width is not None and CUDA_SCALER == 'scale_npp':
+            filters += f',scale_npp={width}:-1:interp_algo=lanczos'
+        elif width is not None and CUDA_SCALER == 'scale_cuda':
+            filters += f',scale_cuda={width}:-1'
+        filters += ',hwdownload,format=nv12'
+        if width is not None and CUDA_SCALER is None:
+            filters += f',scale={width}:-1:flags=lanczos'
+        return hw_args, filters
+
+    # Maintain aspect ratio when width is given
+    if width is not None:
+        filters += f',scale={width}:-1:flags=lanczos'
+    return [], filters
+
+
+def encode_gif(input_args, filters, fps, width, output_path):
+    """Encode with gifski when it is installed and the output width is known, otherwise with FFmpeg's palette filters"""
+    if GIFSKI_AVAILABLE and width is not None:
+        try:
+            run_gifski(input_args, filters, fps, width, output_path)
+            return
+        except EncoderError as e:
+            # Only gifski itself failed, so the same frames can still go through the palette filters
+            print(f"gifski encoding failed, falling back to FFmpeg palettes: {e}")
+
+    run_palette_passes(input_args, filters, output_path)
+
+
+def convert_video_to_gif(input_path, output_path, start_time=None, end_time=None, fps=10, width=None, source_width=None):
+    """Convert video to GIF with gifski, or FFmpeg's two-pass palettegen/paletteuse filter graph"""
+    gif_width = width if width is not None else source_width
+
+    # Seek options go before -i so FFmpeg seeks in the input instead of decoding up to start_time
+    seek_args = []
+    if start_time is not None:
+        seek_args.extend(['-ss', str(start_time)])
+    if end_time is not None:
+        seek_args.extend(['-to', str(end_time)])
+
+    if CUDA_AVAILABLE:
+        hw_args, filters = build_filter_chain(fps, width, use_cuda=True)
+        try:
+            encode_gif(hw_args + seek_args + ['-i', input_path], filters, fps, gif_width, output_path)
+            return True
+        except Exception as e:
+            # Codecs NVDEC can't handle end up here; fall back to the software path below
+            print(f"CUDA conversion failed, retrying on CPU: {e}")
+
+    hw_args, filters = build_filter_chain(fps, width)
+    encode_gif(seek_args + ['-i', input_path], filters, fps, gif_width, output_path)
+
     return True
 
 
+def convert_clips_to_gifs(input_path, clips, output_paths, use_cuda=False):
+    """Encode several (fps, width, start_time, end_time) clips of one video with two FFmpeg runs"""
+    # Each run demuxes the input once and splits it into a trim branch per clip. Palettes are built
+    # in the first run and applied in the second, since palettegen only emits at the end of a clip
+    # and a single-run split graph would hold every decoded frame in memory until then
+    # Only decode the window the clips cover: seek to the earliest start and, when every clip has
+    # an end, stop at the latest one. Input seeking resets timestamps, so trims are made relative
+    seek_start = min(start_time or 0 for _, _, start_time, _ in clips)
+    seek_args = ['-ss', str(seek_start)] if seek_start else []
+    if all(end_time is not None for _, _, _, end_time in clips):
+        seek_args.extend(['-to', str(max(end_time for _, _, _, end_time in clips))])
+
+    hw_args = []
+    labels = ''.join(f'[v{i}]' for i in range(len(clips)))
+    branches = []
+    for fps, width, start_time, end_time in clips:
+        trim = []
+        if start_time is not None and start_time > seek_start:
+            trim.append(f'start={start_time - seek_start}')
+        if end_time is not None:
+            trim.append(f'end={end_time - seek_start}')
+        trim = f"trim={':'.join(trim)},setpts=PTS-STARTPTS," if trim else ''
+
+        hw_args, filters = build_filter_chain(fps, width, use_cuda=use_cuda)
+        branches.append(f'{trim}{filters}')
+
+    # The palettes are written to temporary PNGs and removed once the GIFs are encoded
+    palettes = []
+    try:
+        for _ in clips:
+            palette = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+            palette.close()
+            palettes.append(palette.name)
+
+        # Pass 1: one palette per clip
+        graph = [f'[0:v]split={len(clips)}{labels}']
+        output_args = []
+        for i, branch in enumerate(branches):
+            graph.append(f'[v{i}]{branch},palettegen=stats_mode=diff[p{i}]')
+            output_args.extend(['-map', f'[p{i}]', '-y', palettes[i]])
+        run_ffmpeg(hw_args + seek_args + ['-i', input_path, '-filter_complex', ';'.join(graph)] + output_args)
+
+        # Pass 2: encode each clip against its palette (input i + 1)
+        palette_args = []
+        graph = [f'[0:v]split={len(clips)}{labels}']
+        output_args = []
+        for i, branch in enumerate(branches):
+            palette_args.extend(['-i', palettes[i]])
+            graph.append(f'[v{i}]{branch}[x{i}];[x{i}][{i + 1}:v]paletteuse=dither=bayer:bayer_scale=5[o{i}]')
+            output_args.extend(['-map', f'[o{i}]', '-y', output_paths[i]])
+        run_ffmpeg(hw_args + seek_args + ['-i', input_path] + palette_args + ['-filter_complex', ';'.join(graph)] + output_args)
+    finally:
+        for palette in palettes:
+            delete_file_safely(palette)
+
+
+def batch_convert_video_to_gifs(input_path, clips, output_paths):
+    """Convert several clips of the same video, using NVDEC/NPP when available"""
+    if CUDA_AVAILABLE:
+        try:
+            convert_clips_to_gifs(input_path, clips, output_paths, use_cuda=True)
+            return True
+        except Exception as e:
+            print(f"CUDA conversion failed, retrying on CPU: {e}")
+
+    convert_clips_to_gifs(input_path, clips, output_paths)
+
+    return True
+
+
+def feed_stream(proc, stream, chunk_size=64 * 1024):
+    """Copy a file-like stream into a subprocess's stdin in chunks, then wait for it to exit"""
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            proc.stdin.write(chunk)
+    except BrokenPipeError:
+        # The process stopped reading early; its return code reports why
+        pass
+    finally:
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        proc.wait()
+
+
+def run_ffprobe(stream, args):
+    """Run ffprobe on an upload stream with JSON output, rewind the stream and return (returncode, info)"""
+    # A spooled upload can be opened by path, letting ffprobe seek to the metadata it needs;
+    # in-memory uploads are piped in instead
+    path = spooled_upload_path(stream)
+    cmd = ['ffprobe', '-v', 'error'] + args + ['-of', 'json', path or 'pipe:0']
+
+    # The JSON report is only written once the input has been read, so it can't block our writes
+    with tempfile.TemporaryFile() as output:
+        if path:
+            proc = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=output, stderr=subprocess.DEVNULL)
+        else:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=output, stderr=subprocess.DEVNULL)
+            feed_stream(proc, stream)
+            stream.seek(0)
+        output.seek(0)
+        try:
+            info = json.loads(output.read() or b'{}')
+        except ValueError:
+            info = {}
+
+    return proc.returncode, info
+
+
+def probe_video(stream):
+    """Validate an uploaded video's first stream with ffprobe and rewind it; raise ValueError if unusable
+
+    Returns the stream's ffprobe entries (codec_name, width, height, ...) with ``duration`` as a float.
+    """
+    # ffprobe only parses container/stream headers, so bad inputs are rejected without decoding any frames
+    returncode, info = run_ffprobe(stream, [
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,width,height,duration,avg_frame_rate:format=duration'
+    ])
+
+    streams = info.get('streams') or []
+    if returncode != 0 or not streams:
+        raise ValueError('The uploaded file does not contain a readable video stream')
+
+    codec = streams[0].get('codec_name')
+    if codec not in ALLOWED_CODECS:
+        raise ValueError(f"Unsupported video codec: {codec}")
+
+    # Some containers (e.g. MKV/WebM) only report the duration at the format level
+    video = streams[0]
+    duration = video.get('duration') or info.get('format', {}).get('duration')
+    if duration is None:
+        # MPEG-PS/TS, FLV and recorded WebM often carry no duration; only then pay for demuxing the
+        # whole file to count packets, and refuse inputs whose length can't be bounded at all
+        try:
+            frame_rate = fractions.Fraction(video.get('avg_frame_rate', '0/0'))
+        except (ValueError, ZeroDivisionError):
+            frame_rate = 0
+        if frame_rate <= 0:
+            raise ValueError('Could not determine the video duration')
+        _, counted = run_ffprobe(stream, [
+            '-select_streams', 'v:0', '-count_packets', '-show_entries', 'stream=nb_read_packets'
+        ])
+        packets = (counted.get('streams') or [{}])[0].get('nb_read_packets')
+        if not packets:
+            raise ValueError('Could not determine the video duration')
+        duration = int(packets) / frame_rate
+
+    video['duration'] = float(duration)
+    if video['duration'] > MAX_VIDEO_DURATION:
+        raise ValueError(f"Video is too long. Maximum duration is {MAX_VIDEO_DURATION} seconds")
+
+    return video
+
+
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
-        # Clean old files first to free up space
-        clean_old_files(app.config['UPLOAD_FOLDER'])
-        clean_old_files(app.config['OUTPUT_FOLDER'])
-        clean_old_files(os.path.join('static', 'gifs'))
-
         # Check if the post request has the file part
         if 'video' not in request.files:
             flash('No file part')
@@ -113,64 +560,63 @@ def upload_file():
             return redirect(request.url)
 
         if file and allowed_file(file.filename):
-            # Get conversion parameters
-            fps = int(request.form.get('fps', 10))
-            width = request.form.get('width', '')
-            if width and width.isdigit():
-                width = int(width)
-            else:
-                width = None
-
-            # Handle start and end time
-            start_time = request.form.get('start_time', '')
-            end_time = request.form.get('end_time', '')
-
+            # Get and validate conversion parameters
             try:
-                if start_time:
-                    start_time = float(start_time)
-                else:
-                    start_time = None
-
-                if end_time:
-                    end_time = float(end_time)
-                else:
-                    end_time = None
-            except ValueError:
-                flash('Invalid time format. Please use seconds (e.g., 10.5)')
+                fps, width, start_time, end_time = parse_conversion_params(request.form)
+            except ValueError as e:
+                flash(str(e))
                 return redirect(request.url)
 
             # Create unique filenames using timestamp
             timestamp = int(time.time())
             filename = f"{timestamp}_{secure_filename(file.filename)}"
-            input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            
-            # Save the uploaded file
-            file.save(input_path)
+            input_path = None
+            tmp_gif_path = None
 
-            # Create output filename
-            gif_filename = f"{os.path.splitext(filename)[0]}.gif"
+            # Name the GIF after the upload's content and the parameters so identical requests reuse it
+            digest = hash_stream(file.stream)
+            gif_filename = gif_cache_name(digest, fps, width, start_time, end_time)
             gif_path = os.path.join(app.config['OUTPUT_FOLDER'], gif_filename)
-            static_gif_path = os.path.join('static', 'gifs', gif_filename)
 
             try:
-                # Convert video to GIF using FFmpeg
-                convert_video_to_gif(
-                    input_path=input_path,
-                    output_path=gif_path,
-                    start_time=start_time,
-                    end_time=end_time,
-                    fps=fps,
-                    width=width
-                )
-
-                # Instead of copying, just create a symlink to save disk space
-                # (Remove previous link first if it exists)
-                if os.path.exists(static_gif_path):
-                    os.remove(static_gif_path)
-                
-                # Determine relative path for symlink
-                rel_path = os.path.relpath(gif_path, os.path.dirname(static_gif_path))
-                os.symlink(rel_path, static_gif_path)
+                try:
+                    # Cache hit: bump the mtime so the janitor keeps it around a while longer
+                    os.utime(gif_path)
+                    converted = True
+                except FileNotFoundError:
+                    converted = False
+
+                if not converted:
+                    # Reject corrupt, oversized or unsupported inputs before spending a full transcode on them
+                    video = probe_video(file.stream)
+                    # Rotated videos swap width and height on output, so cap at the larger side
+                    source_width = max(video.get('width') or 0, video.get('height') or 0) or None
+
+                    # Encode to a private temporary name so concurrent identical uploads can't interleave writes
+                    fd, tmp_gif_path = tempfile.mkstemp(suffix='.gif', dir=app.config['OUTPUT_FOLDER'])
+                    os.fchmod(fd, GIF_FILE_MODE)
+                    os.close(fd)
+
+                    # Convert straight from Werkzeug's spooled copy when possible; otherwise save the upload
+                    source_path = spooled_upload_path(file.stream)
+                    if source_path is None:
+                        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                        file.save(input_path)
+                        source_path = input_path
+
+                    # Convert video to GIF using FFmpeg
+                    convert_video_to_gif(
+                        input_path=source_path,
+                        output_path=tmp_gif_path,
+                        start_time=start_time,
+                        end_time=end_time,
+                        fps=fps,
+                        width=width,
+                        source_width=source_width
+                    )
+
+                if tmp_gif_path:
+                    os.replace(tmp_gif_path, gif_path)
 
                 # Store minimal information in session
                 session['gif_filename'] = gif_filename
@@ -179,8 +625,6 @@ def upload_file():
                 
                 # Store file paths for later cleanup
                 session['input_path'] = input_path
-                session['gif_path'] = gif_path
-                session['static_gif_path'] = static_gif_path
 
                 # Delete the uploaded video immediately if not needed anymore
                 # (uncomment if you don't need to keep originals)
@@ -189,8 +633,11 @@ def upload_file():
                 return redirect(url_for('result'))
 
             except Exception as e:
-                # Clean up the input file in case of error
-                delete_file_safely(input_path)
+                # Clean up the input file and partial GIF in case of error
+                if input_path:
+                    delete_file_safely(input_path)
+                if tmp_gif_path:
+                    delete_file_safely(tmp_gif_path)
                 flash(f"Conversion failed: {str(e)}")
                 return redirect(request.url)
         else:
@@ -200,6 +647,104 @@ def upload_file():
     return render_template('upload.html')
 
 
+@app.route('/batch', methods=['POST'])
+def batch_convert():
+    """Convert several time ranges of one uploaded video and return their GIF URLs as JSON
+
+    Expects a multipart form with the ``video`` file and a ``clips`` field holding a JSON
+    list such as ``[{"start": 0, "end": 2.5, "fps": 10, "width": 320}, ...]``.
+    """
+    file = request.files.get('video')
+    if not file or file.filename == '':
+        return jsonify(error='No selected file'), 400
+    if not allowed_file(file.filename):
+        return jsonify(error=f"Invalid file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"), 400
+
+    try:
+        clips = json.loads(request.form.get('clips', ''))
+        if not isinstance(clips, list) or not clips or not all(isinstance(clip, dict) for clip in clips):
+            raise ValueError
+    except ValueError:
+        return jsonify(error='clips must be a non-empty JSON list of objects'), 400
+    if len(clips) > MAX_BATCH_CLIPS:
+        return jsonify(error=f'At most {MAX_BATCH_CLIPS} clips per batch'), 400
+
+    # Reuse the single-upload validation by mapping each clip onto the form field names
+    try:
+        params = [
+            parse_conversion_params({
+                field: '' if clip.get(key) is None else str(clip.get(key))
+                for field, key in (('fps', 'fps'), ('width', 'width'), ('start_time', 'start'), ('end_time', 'end'))
+            })
+            for clip in clips
+        ]
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    digest = hash_stream(file.stream)
+    gif_filenames = [gif_cache_name(digest, *clip) for clip in params]
+    gif_paths = [os.path.join(app.config['OUTPUT_FOLDER'], name) for name in gif_filenames]
+
+    # Only convert clips that aren't cached yet; cached ones get their TTL extended
+    pending = []
+    for i, gif_path in enumerate(gif_paths):
+        try:
+            os.utime(gif_path)
+        except FileNotFoundError:
+            pending.append(i)
+
+    input_path = None
+    tmp_gif_paths = []
+    try:
+        if pending:
+            video = probe_video(file.stream)
+            # A clip starting past the end would produce an empty palette and fail the whole batch
+            for i in pending:
+                start_time = params[i][2]
+                if start_time is not None and start_time >= video['duration']:
+                    raise ValueError(f"Clip {i + 1} starts after the end of the video ({video['duration']:.2f}s)")
+
+            # Convert straight from Werkzeug's spooled copy when possible; otherwise save the upload
+            source_path = spooled_upload_path(file.stream)
+            if source_path is None:
+                input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{int(time.time())}_{secure_filename(file.filename)}")
+                file.save(input_path)
+                source_path = input_path
+
+            for _ in pending:
+                fd, tmp_gif_path = tempfile.mkstemp(suffix='.gif', dir=app.config['OUTPUT_FOLDER'])
+                os.fchmod(fd, GIF_FILE_MODE)
+                os.close(fd)
+                tmp_gif_paths.append(tmp_gif_path)
+
+            batch_convert_video_to_gifs(source_path, [params[i] for i in pending], tmp_gif_paths)
+
+            for i, tmp_gif_path in zip(pending, tmp_gif_paths):
+                os.replace(tmp_gif_path, gif_paths[i])
+            tmp_gif_paths = []
+    except ValueError as e:
+        # Raised by probe_video for unusable inputs
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        return jsonify(error=f"Conversion failed: {str(e)}"), 500
+    finally:
+        # Every clip came out of this batch, so the source video isn't needed anymore;
+        # temporary GIFs are only left behind if the conversion failed
+        if input_path:
+            delete_file_safely(input_path)
+        for tmp_gif_path in tmp_gif_paths:
+            delete_file_safely(tmp_gif_path)
+
+    return jsonify(gifs=[
+        {
+            'filename': name,
+            'download_url': url_for('download_file', filename=name),
+            'preview_url': url_for('preview_file', filename=name),
+        }
+        for name in gif_filenames
+    ])
+
+
 @app.route('/result')
 def result():
     if 'gif_filename' not in session:
@@ -219,48 +764,40 @@ def result():
 
 @app.route('/gifs/<filename>')
 def download_file(filename):
-    """Send the file for download and delete uploaded and generated files"""
-    # Send the file first
-    response = send_from_directory(app.config['OUTPUT_FOLDER'], filename, as_attachment=True)
-
-    # Schedule cleanup for after response is sent
-    @response.call_on_close
-    def cleanup_after_download():
-        try:
-            # Get paths from session for deletion
-            input_path = session.get('input_path')
-            gif_path = session.get('gif_path')
-            static_gif_path = session.get('static_gif_path')
-
-            # Delete session-stored paths if they exist
-            if input_path:
-                delete_file_safely(input_path)
-
-            if gif_path:
-                delete_file_safely(gif_path)
-
-            if static_gif_path and os.path.islink(static_gif_path):
-                os.unlink(static_gif_path)
-            elif static_gif_path:
-                delete_file_safely(static_gif_path)
-
-            # Clear session data
-            session.pop('gif_filename', None)
-            session.pop('original_filename', None)
-            session.pop('gif_size', None)
-            session.pop('input_path', None)
-            session.pop('gif_path', None)
-            session.pop('static_gif_path', None)
-
-        except Exception as e:
-            print(f"Error during file cleanup: {e}")
+    """Send the file for download and delete the uploaded video"""
+    if app.config['ACCEL_REDIRECT_PREFIX']:
+        # nginx serves the file with sendfile(2); only hand it names we generated ourselves
+        if secure_filename(filename) != filename:
+            abort(404)
+        response = Response(mimetype='image/gif')
+        response.headers['X-Accel-Redirect'] = f"{app.config['ACCEL_REDIRECT_PREFIX']}/{filename}"
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    else:
+        # Send the file first (emits X-Sendfile instead of the body when USE_X_SENDFILE is set)
+        response = send_from_directory(app.config['OUTPUT_FOLDER'], filename, as_attachment=True)
+
+    # Hand the uploaded video to the deleter thread so this worker returns straight away.
+    # GIFs are shared by identical uploads (and may still be read by an offloading
+    # front-end server), so they are left for the janitor to expire
+    input_path = session.pop('input_path', None)
+    if input_path:
+        delete_queue.put(input_path)
+
+    # Clear session data while the request context (and session) is still available
+    session.pop('gif_filename', None)
+    session.pop('original_filename', None)
+    session.pop('gif_size', None)
 
     return response
 
 
 @app.route('/preview/<filename>')
 def preview_file(filename):
-    return send_from_directory(os.path.join('static', 'gifs'), filename)
+    response = send_from_directory(app.config['OUTPUT_FOLDER'], filename, conditional=True)
+    # A name can be re-encoded with different bytes (gifski/palettes, GPU/CPU) after the janitor
+    # expires it, so cache only for the cleanup window and let conditional requests revalidate
+    response.headers['Cache-Control'] = f'public, max-age={CLEANUP_MAX_AGE_HOURS * 3600}'
+    return response
 
 
 @app.errorhandler(413)
@@ -269,15 +806,9 @@ def request_entity_too_large(error):
     return redirect(url_for('upload_file')), 413
 
 
-# Register periodic cleanup function to run on each request
-@app.before_request
-def cleanup_before_request():
-    # Only run cleanup occasionally (1% of requests) to avoid overhead
-    import random
-    if random.random() < 0.01:
-        clean_old_files(app.config['UPLOAD_FOLDER'], max_age_hours=1)
-        clean_old_files(app.config['OUTPUT_FOLDER'], max_age_hours=1)
-        clean_old_files(os.path.join('static', 'gifs'), max_age_hours=1)
+# Sweep old files and delete downloaded uploads in the background instead of on the request path
+threading.Thread(target=cleanup_loop, daemon=True).start()
+threading.Thread(target=delete_worker, daemon=True).start()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,13 @@
+# Gunicorn settings for serving the converter.
+# Requests spend most of their time waiting on uploads and the FFmpeg subprocess,
+# so a few processes with several threads each overlap that I/O cheaply.
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+worker_class = 'gthread'
+# Without a shared SECRET_KEY each process signs sessions with its own random key,
+# so only scale past one process once SECRET_KEY is set
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 if os.environ.get('SECRET_KEY') else 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# Conversions of long clips can take a while; don't let the arbiter kill busy workers
+timeout = 300